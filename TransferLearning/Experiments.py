@@ -19,7 +19,7 @@ from TrainModels import *
 # Main
 ###################################################
 # The way to get one batch from the data_loader
-from LoadData import get_data_loader
+from LoadData import get_data_loader, NORM_MEAN, NORM_STD
 def GetUpperDir():
     return os.path.abspath(os.path.join(os.path.dirname(__file__),".."))
 
@@ -30,8 +30,11 @@ if __name__ == "__main__":
     print("PyTorch Version: ",torch.__version__)
     print("Torchvision Version: ",torchvision.__version__)
 
+    # For multi-GPU training launch with: torchrun --nproc_per_node=N Experiments.py
+    distributed, local_rank = init_distributed()
+
     # Detect if we have a GPU available
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    device = torch.device("cuda:{}".format(local_rank) if torch.cuda.is_available() else "cpu")
 
     # Define argparser
     parser = argparse.ArgumentParser(description='NeuroImage_Neuron')
@@ -57,15 +60,28 @@ if __name__ == "__main__":
     # Number of epochs to train for 
     args.num_epochs = 15
 
+    # Number of batches to accumulate the gradients over before each optimizer step
+    #   (effective batch size = batch_size * grad_accum_steps, without the memory of a large batch)
+    args.grad_accum_steps = 1
+
     # Flag for feature extracting. When False, we finetune the whole model, 
     #   when True we only update the reshaped layer params
     args.feature_extract = True
 
+    # Flag for activation checkpointing of the inception blocks (finetuning only). Recomputes the
+    #   activations in backward so that a larger batch fits in the GPU memory
+    args.memory_efficient = False
+
+    # Flag for folding the BN layers of the frozen backbone into its convs (feature extracting only).
+    #   Faster, but the backbone then normalizes with the pretrained running statistics in training too
+    args.fuse_bn = False
+
     """
     Initialize the Model for Transfer Learning
     """
     # Initialize the model for this run
-    model_ft, input_size = initialize_model(args.model_name, args.num_classes, args.feature_extract, use_pretrained=True)
+    model_ft, input_size = initialize_model(args.model_name, args.num_classes, args.feature_extract, use_pretrained=True,
+        memory_efficient=args.memory_efficient, fuse_bn=args.fuse_bn)
 
     # Print the model we just instantiated
     print(model_ft)
@@ -76,14 +92,21 @@ if __name__ == "__main__":
     """
     # From Data Folders
     print("Initializing Datasets and Dataloaders...")
-    data_loaders = get_data_loader()
+    data_loaders = get_data_loader(distributed=distributed)
 
 
     """
     Create the Optimizer
     """
-    # Send the model to GPU
-    model_ft = model_ft.to(device)
+    # Send the model to GPU (channels_last is the native layout of the cuDNN tensor-core conv kernels)
+    model_ft = model_ft.to(device, memory_format=torch.channels_last)
+    # INT8 frozen backbone layers when feature extracting (quantized kernels only run on the CPU)
+    if args.feature_extract and device.type == 'cpu':
+        model_ft = quantize_backbone(model_ft)
+    # One process per GPU; gradients are all-reduced in buckets while backward is still running
+    if distributed:
+        model_ft = DDP(model_ft, device_ids=[local_rank] if device.type == 'cuda' else None)
+    model_ft = compile_model(model_ft, device)
 
     # Gather the parameters to be optimized/updated in this run. If we are
     #  finetuning we will be updating all parameters. However, if we are 
@@ -105,7 +128,7 @@ if __name__ == "__main__":
 
 
     # Observe that all parameters are being optimized
-    optimizer_ft = optim.SGD(params_to_update, lr=0.001, momentum=0.9)
+    optimizer_ft = create_sgd_optimizer(params_to_update, lr=0.001, momentum=0.9)
     # Setup the loss fxn
     criterion = nn.CrossEntropyLoss()
 
@@ -115,19 +138,25 @@ if __name__ == "__main__":
     """
     # Train and evaluate
     model_ft, hist = train_model(model_ft, data_loaders, criterion, optimizer_ft, 
-        device, 'aug_train', 'val', num_epochs=args.num_epochs, is_inception=(args.model_name=="inception"))
+        device, 'aug_train', 'val', num_epochs=args.num_epochs, is_inception=(args.model_name=="inception"),
+        mean=NORM_MEAN, std=NORM_STD, grad_accum_steps=args.grad_accum_steps)
+
 
+    main_process = is_main_process()
+    if distributed:
+        torch.distributed.destroy_process_group()
 
     # Plot the training curves of validation accuracy vs. number 
     #  of training epochs for the transfer learning method and
     #  the model trained from scratch
-    ohist = [h.cpu().numpy() for h in hist]
-
-    plt.title("Validation Accuracy vs. Number of Training Epochs")
-    plt.xlabel("Training Epochs")
-    plt.ylabel("Validation Accuracy")
-    plt.plot(range(1,args.num_epochs+1),ohist,label="Pretrained")
-    plt.ylim((0,1.))
-    plt.xticks(np.arange(1, args.num_epochs+1, 1.0))
-    plt.legend()
-    plt.show(block=True)
+    if main_process:
+        ohist = [h.cpu().numpy() for h in hist]
+
+        plt.title("Validation Accuracy vs. Number of Training Epochs")
+        plt.xlabel("Training Epochs")
+        plt.ylabel("Validation Accuracy")
+        plt.plot(range(1,args.num_epochs+1),ohist,label="Pretrained")
+        plt.ylim((0,1.))
+        plt.xticks(np.arange(1, args.num_epochs+1, 1.0))
+        plt.legend()
+        plt.show(block=True)
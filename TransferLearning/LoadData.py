@@ -1,6 +1,7 @@
 import torch
 import torchvision
-import torchvision.transforms as transforms
+# transforms v2 run on tensors and are faster than v1 on PIL images
+import torchvision.transforms.v2 as transforms
 import numpy as np
 import os
 from pathlib import Path
@@ -24,15 +25,23 @@ torchvision에서의 사용가능한 일반적인 데이터셋 중 하나는 ``I
 여기서'ants', 'bees'는 class labels입니다.
 '''
 
+# Normalization is not part of the transforms below, it is applied on the GPU
+#   in train_model (pass mean=NORM_MEAN, std=NORM_STD)
+NORM_MEAN = (0.5,0.5,0.5)
+NORM_STD = (0.5,0.5,0.5)
+
 des_path = Path(__file__).parents[1].joinpath('data/ND2-Neuron/')
 #des_path = os.path.join(os.getcwd(),'dataset\\class10\\images')
 
-def get_data_loader(data_dir= des_path, batch_size=4, num_workers=0):
+def get_data_loader(data_dir= des_path, batch_size=4, num_workers=0, pin_memory=True, distributed=False):
     """
     Define the way we compose the batch dataset including the augmentation for increasing the number of data
     and return the augmented batch-dataset
     :param data_dir: root directory where the either train or test dataset is
     :param batch_size: size of the batch
+    :param num_workers: number of worker processes for loading the data
+    :param pin_memory: true to load the batches into page-locked memory for asynchronous copies to the GPU
+    :param distributed: true to split each dataset across the processes of the DDP process group
     :param train: true if current phase is training, else false
     :return: augmented batch dataset
     """
@@ -40,26 +49,26 @@ def get_data_loader(data_dir= des_path, batch_size=4, num_workers=0):
     # define how we augment the data for composing the batch-dataset in train and test step
     transform = {
         'train': transforms.Compose([
+            transforms.ToImage(), # PIL -> uint8 tensor, so resize/flip run on the tensor kernels
             transforms.Resize([224,224]), # Resizing the image as the VGG only take 224 x 244 as input size
             transforms.RandomHorizontalFlip(), # Flip the data horizontally
             #TODO if it is needed, add the random crop
-            transforms.ToTensor(),
-            transforms.Normalize(mean=(0.5,0.5,0.5), std=(0.5,0.5,0.5))
+            transforms.ToDtype(torch.float32, scale=True)
         ]),
         'aug_train': transforms.Compose([
+            transforms.ToImage(), # PIL -> uint8 tensor, so resize runs on the tensor kernels
             transforms.Resize([224,224]), # Resizing the image as the VGG only take 224 x 244 as input size
-            transforms.ToTensor(),
-            transforms.Normalize(mean=(0.5,0.5,0.5), std=(0.5,0.5,0.5))
+            transforms.ToDtype(torch.float32, scale=True)
         ]),        
         'val': transforms.Compose([
+            transforms.ToImage(), # PIL -> uint8 tensor, so resize runs on the tensor kernels
             transforms.Resize([224,224]), # Resizing the image as the VGG only take 224 x 244 as input size
-            transforms.ToTensor(),
-            transforms.Normalize(mean=(0.5,0.5,0.5), std=(0.5,0.5,0.5))
+            transforms.ToDtype(torch.float32, scale=True)
         ]),        
         'test': transforms.Compose([
+            transforms.ToImage(), # PIL -> uint8 tensor, so resize runs on the tensor kernels
             transforms.Resize([224,224]),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=(0.5,0.5,0.5), std=(0.5,0.5,0.5))
+            transforms.ToDtype(torch.float32, scale=True)
         ])
     }
 
@@ -68,7 +77,13 @@ def get_data_loader(data_dir= des_path, batch_size=4, num_workers=0):
     # ImageFloder with root directory and defined transformation methods for batch as well as data augmentation    
     image_datasets = {x: torchvision.datasets.ImageFolder(os.path.join(data_dir, x), transform[x])
                 for x in load_setnames}
-    dataloaders = {x: torch.utils.data.DataLoader(image_datasets[x], batch_size=batch_size, shuffle=True, num_workers=num_workers)
+    # With DDP, the DistributedSampler does the shuffling (DataLoader's shuffle must then be False)
+    samplers = {x: torch.utils.data.distributed.DistributedSampler(image_datasets[x], shuffle=True) if distributed else None
+                for x in load_setnames}
+    dataloaders = {x: torch.utils.data.DataLoader(image_datasets[x], batch_size=batch_size, shuffle=not distributed,
+                                                  sampler=samplers[x], num_workers=num_workers,
+                                                  pin_memory=pin_memory and torch.cuda.is_available(),
+                                                  persistent_workers=num_workers > 0)
                 for x in load_setnames}
 
     return dataloaders
@@ -5,6 +5,8 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
+import torch.utils.checkpoint
+import torch._dynamo
 import numpy as np
 import torchvision
 from torchvision import datasets, models, transforms
@@ -13,8 +15,201 @@ import time
 import os
 import copy
 import argparse
+import contextlib
+import functools
+from torch.nn.parallel import DistributedDataParallel as DDP
 
 
+"""
+Class:      DataPrefetcher
+
+Wraps a DataLoader and copies the next batch to the GPU on a side CUDA stream
+while the current batch is being trained (same pattern as Apex's data_prefetcher).
+The images are handed out in channels_last (NHWC) layout to match the model and,
+if mean/std are given, normalized on the device instead of in the DataLoader workers.
+
+Ref:        https://github.com/NVIDIA/apex/blob/master/examples/imagenet/main_amp.py
+"""
+class DataPrefetcher:
+    def __init__(self, loader, device, memory_format=torch.channels_last, mean=None, std=None):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.memory_format = memory_format
+        self.stream = torch.cuda.Stream(device=self.device) if self.device.type == 'cuda' else None
+
+        # (x - mean) / std == x * (1 / std) + (-mean / std), i.e. a single addcmul kernel per batch
+        self.scale, self.shift = None, None
+        if mean is not None and std is not None:
+            mean = torch.tensor(mean, dtype=torch.float32, device=self.device).view(1, -1, 1, 1)
+            std = torch.tensor(std, dtype=torch.float32, device=self.device).view(1, -1, 1, 1)
+            self.scale, self.shift = 1.0 / std, -mean / std
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        # Nothing to overlap on CPU, just hand out the batches
+        if self.stream is None:
+            for inputs, labels in self.loader:
+                inputs = inputs.to(self.device, memory_format=self.memory_format)
+                yield self._normalize(inputs), labels.to(self.device)
+            return
+
+        # scale/shift were computed on the current stream, make sure the side stream sees them
+        self.stream.wait_stream(torch.cuda.current_stream(self.device))
+        loader_iter = iter(self.loader)
+        next_batch = self._preload(loader_iter)
+        while next_batch is not None:
+            # Wait for the copy of this batch, then start copying the next one
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_stream(self.stream)
+            inputs, labels = next_batch
+            # The tensors were allocated on the side stream but are consumed on the current one
+            inputs.record_stream(current_stream)
+            labels.record_stream(current_stream)
+            next_batch = self._preload(loader_iter)
+            yield inputs, labels
+
+    def _preload(self, loader_iter):
+        try:
+            inputs, labels = next(loader_iter)
+        except StopIteration:
+            return None
+        # non_blocking copies overlap with compute when the DataLoader uses pin_memory=True
+        with torch.cuda.stream(self.stream):
+            inputs = inputs.to(self.device, non_blocking=True, memory_format=self.memory_format)
+            inputs = self._normalize(inputs)
+            labels = labels.to(self.device, non_blocking=True)
+        return inputs, labels
+
+    def _normalize(self, inputs):
+        if self.scale is None:
+            return inputs
+        return torch.addcmul(self.shift, inputs, self.scale)
+
+"""
+Function:   trace_eval_model
+
+Traces the model (in eval mode) with torch.jit.trace for the forward-only validation pass.
+The traced module shares the parameters and buffers of the model, so it keeps up with the
+optimizer updates and with load_state_dict without re-tracing.
+
+Ref:        https://pytorch.org/docs/stable/generated/torch.jit.trace.html
+"""
+def trace_eval_model(model, example_inputs, use_amp=False, amp_dtype=torch.float16):
+    # A torch.compile'd or DDP-wrapped model is left as it is
+    if hasattr(model, '_orig_mod') or isinstance(model, DDP):
+        return model
+    try:
+        # Called from the inference_mode validation pass: trace outside of it (under no_grad) and
+        #   on a normal copy of the inference tensor batch. The autocast weight cache has to be
+        #   disabled while tracing.
+        with torch.inference_mode(False), torch.no_grad(), \
+                torch.autocast(device_type='cuda', dtype=amp_dtype, enabled=use_amp, cache_enabled=False):
+            return torch.jit.trace(model, example_inputs.clone(), check_trace=False)
+    except RuntimeError as e:
+        # Tracing errors (e.g. an unsupported op) only lose the speedup, the eager model gives the same outputs
+        print("WARNING: torch.jit.trace failed ({}), using the eager model for validation...".format(e))
+        return model
+
+"""
+Function:   _run_train_epoch
+
+One pass over the training batches (forward + backward + optimizer steps). The loss and, if
+train_acc, the number of correct predictions are accumulated in place into running_loss/running_corrects.
+"""
+@torch.enable_grad()
+def _run_train_epoch(model, batches, criterion, optimizer, scaler, is_inception, use_amp, amp_dtype,
+                     grad_accum_steps, train_acc, running_loss, running_corrects):
+    # zero the parameter gradients (set to None instead of writing zeros into every grad tensor)
+    optimizer.zero_grad(set_to_none=True)
+    num_batches = len(batches)
+
+    for i, (inputs, labels) in enumerate(batches):
+        # Gradient accumulation: only step the optimizer every grad_accum_steps batches
+        #   (and on the last one). With DDP, skip the gradient all-reduce on the other batches.
+        is_step = (i + 1) % grad_accum_steps == 0 or (i + 1) == num_batches
+        # The last window is shorter if num_batches is not a multiple of grad_accum_steps
+        window_size = min(grad_accum_steps, num_batches - (i // grad_accum_steps) * grad_accum_steps)
+        sync_context = model.no_sync() if not is_step and hasattr(model, 'no_sync') else contextlib.nullcontext()
+
+        with sync_context:
+            # Get model outputs and calculate loss
+            # Special case for inception because in training it has an auxiliary output. In train
+            #   mode we calculate the loss by summing the final output and the auxiliary output
+            #   but in testing we only consider the final output.
+            with torch.autocast(device_type='cuda', dtype=amp_dtype, enabled=use_amp):
+                if is_inception:
+                    # From https://discuss.pytorch.org/t/how-to-optimize-inception-model-with-auxiliary-classifiers/7958
+                    outputs, aux_outputs = model(inputs)
+                    loss1 = criterion(outputs, labels)
+                    loss2 = criterion(aux_outputs, labels)
+                    loss = loss1 + 0.4*loss2
+                else:
+                    outputs = model(inputs)
+                    loss = criterion(outputs, labels)
+
+            # backward outside autocast, backward ops run in the same dtype as their forward counterparts
+            scaler.scale(loss / window_size).backward()
+
+        if is_step:
+            scaler.step(optimizer)
+            scaler.update()
+            optimizer.zero_grad(set_to_none=True)
+
+        # statistics (the argmax for the accuracy is skipped unless train_acc, the loss is enough)
+        running_loss += loss.detach() * inputs.size(0)
+        if train_acc:
+            _, preds = torch.max(outputs, 1)
+            running_corrects += (preds == labels).sum()
+
+"""
+Function:   _run_eval_epoch
+
+One forward-only pass over the validation batches under inference_mode (which also skips the
+version counter and view tracking that set_grad_enabled(False) still does). The statistics are
+accumulated in place like in _run_train_epoch. eval_model is traced on the first batch if None
+(see trace_eval_model) and returned for the next epochs.
+"""
+@torch.inference_mode()
+def _run_eval_epoch(model, eval_model, batches, criterion, use_amp, amp_dtype, running_loss, running_corrects):
+    for inputs, labels in batches:
+        if eval_model is None:
+            eval_model = trace_eval_model(model, inputs, use_amp, amp_dtype)
+
+        with torch.autocast(device_type='cuda', dtype=amp_dtype, enabled=use_amp):
+            outputs = eval_model(inputs)
+            loss = criterion(outputs, labels)
+
+        # statistics
+        _, preds = torch.max(outputs, 1)
+        running_loss += loss * inputs.size(0)
+        running_corrects += (preds == labels).sum()
+
+    return eval_model
+
+"""
+Function:   _clone_state_dict, _copy_state_dict_
+
+Buffer for the best weights: allocated once on the device by _clone_state_dict and updated
+in place with copy_ by _copy_state_dict_ (copy.deepcopy of a state_dict re-allocates everything
+through the slow Python-level deepcopy recursion). copy.copy keeps the OrderedDict and its
+_metadata (the module versions, which e.g. the quantized Linear layers of quantize_backbone need
+in load_state_dict). Non-tensor entries (the dtype and packed params of quantize_backbone) are
+frozen and kept as they are.
+"""
+def _clone_state_dict(model):
+    buffer = copy.copy(model.state_dict())
+    for k, v in buffer.items():
+        if torch.is_tensor(v):
+            buffer[k] = v.detach().clone()
+    return buffer
+
+def _copy_state_dict_(buffer, model):
+    for k, v in model.state_dict().items():
+        if torch.is_tensor(v):
+            buffer[k].copy_(v, non_blocking=True)
+
 """
 Function:   train_model
 
@@ -23,86 +218,158 @@ https://pytorch.org/tutorials/beginner/finetuning_torchvision_models_tutorial.ht
 [Ref - Additioanl]
 https://pytorch.org/tutorials/beginner/transfer_learning_tutorial.html
 """
-def train_model(model, dataloaders, criterion, optimizer, device, train_name, val_name, num_epochs=25, is_inception=False):
+def train_model(model, dataloaders, criterion, optimizer, device, train_name, val_name, num_epochs=25, is_inception=False,
+                mean=None, std=None, grad_accum_steps=1, train_acc=False):
+    if grad_accum_steps < 1:
+        raise ValueError("grad_accum_steps must be >= 1, got {}".format(grad_accum_steps))
+
     since = time.time()
 
+    # Input size is fixed per model (see initialize_model), so let cuDNN autotune
+    #   the conv algorithms once and allow TF32 tensor-core kernels on Ampere+ GPUs.
+    torch.backends.cudnn.benchmark = True
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+
     val_acc_history = []
     
-    best_model_wts = copy.deepcopy(model.state_dict())
+    # Allocated once and updated in place (see _clone_state_dict)
+    best_model_wts = _clone_state_dict(model)
     best_acc = 0.0
 
+    # Mixed precision (AMP): run conv/matmul in half precision on the GPU while the master
+    #   weights stay in FP32. BF16 has the FP32 exponent range and needs no loss scaling;
+    #   FP16 (pre-Ampere GPUs) needs the GradScaler to avoid gradient underflow.
+    #   torch.cuda.is_bf16_supported() is also True on older GPUs (emulated, slow), so check
+    #   for native BF16 support (compute capability >= 8.0) instead.
+    use_amp = torch.device(device).type == 'cuda'
+    amp_dtype = torch.bfloat16 if use_amp and torch.cuda.get_device_capability(device)[0] >= 8 else torch.float16
+    scaler = torch.amp.GradScaler('cuda', enabled=(use_amp and amp_dtype == torch.float16))
+
+    # Traced on the first validation batch (see trace_eval_model)
+    eval_model = None
+
+    # Iterate over data. The next batch is copied to the device while this one trains.
+    #   mean/std: normalization applied on the device (None if the DataLoader already normalizes)
+    #   The prefetchers are created once, so the normalization constants are not rebuilt every epoch.
+    prefetchers = {phase: DataPrefetcher(dataloaders[phase], device, mean=mean, std=std)
+                   for phase in [train_name, val_name]}
+
+    # With DDP, only rank 0 prints (the statistics are all-reduced, so they are the same on every rank)
+    verbose = is_main_process()
+
     for epoch in range(num_epochs):
-        print('Epoch {}/{}'.format(epoch, num_epochs - 1))
-        print('-' * 10)
+        if verbose:
+            print('Epoch {}/{}'.format(epoch, num_epochs - 1))
+            print('-' * 10)
 
         # Each epoch has a training and validation phase
         for phase in [train_name, val_name]:
+            # Reshuffle the per-process shards differently in every epoch
+            sampler = dataloaders[phase].sampler
+            if isinstance(sampler, torch.utils.data.distributed.DistributedSampler):
+                sampler.set_epoch(epoch)
+
+            # Accumulate on the device; calling .item() every step would sync with the GPU
+            running_loss = torch.zeros((), device=device)
+            running_corrects = torch.zeros((), dtype=torch.long, device=device)
+
+            batches = prefetchers[phase]
+
+            # The phase is only checked here, once per epoch, not for every batch
             if phase == train_name:
                 model.train()  # Set model to training mode
+                _run_train_epoch(model, batches, criterion, optimizer, scaler, is_inception, use_amp, amp_dtype,
+                                 grad_accum_steps, train_acc, running_loss, running_corrects)
             else:
                 model.eval()   # Set model to evaluate mode
+                eval_model = _run_eval_epoch(model, eval_model, batches, criterion, use_amp, amp_dtype,
+                                             running_loss, running_corrects)
+
+            # Number of samples this process went through. The DistributedSampler pads the shards
+            #   with duplicates, so this can add up to more than len(dataset) over all processes.
+            num_samples = torch.tensor(len(sampler), device=device)
+
+            # Each process only saw its own shard, so sum the statistics over all processes
+            if torch.distributed.is_available() and torch.distributed.is_initialized():
+                torch.distributed.all_reduce(running_loss)
+                torch.distributed.all_reduce(running_corrects)
+                torch.distributed.all_reduce(num_samples)
+
+            epoch_loss = running_loss.item() / num_samples.item()
+            epoch_acc = running_corrects.double() / num_samples
 
-            running_loss = 0.0
-            running_corrects = 0
-
-            # Iterate over data.
-            for inputs, labels in dataloaders[phase]:
-                inputs = inputs.to(device)
-                labels = labels.to(device)
-
-                # zero the parameter gradients
-                optimizer.zero_grad()
-
-                # forward
-                # track history if only in train
-                with torch.set_grad_enabled(phase == train_name):
-                    # Get model outputs and calculate loss
-                    # Special case for inception because in training it has an auxiliary output. In train
-                    #   mode we calculate the loss by summing the final output and the auxiliary output
-                    #   but in testing we only consider the final output.
-                    if is_inception and phase == train_name:
-                        # From https://discuss.pytorch.org/t/how-to-optimize-inception-model-with-auxiliary-classifiers/7958
-                        outputs, aux_outputs = model(inputs)
-                        loss1 = criterion(outputs, labels)
-                        loss2 = criterion(aux_outputs, labels)
-                        loss = loss1 + 0.4*loss2
-                    else:
-                        outputs = model(inputs)
-                        loss = criterion(outputs, labels)
-
-                    _, preds = torch.max(outputs, 1)
-
-                    # backward + optimize only if in training phase
-                    if phase == train_name:
-                        loss.backward()
-                        optimizer.step()
-
-                # statistics
-                running_loss += loss.item() * inputs.size(0)
-                running_corrects += torch.sum(preds == labels.data)
-
-            epoch_loss = running_loss / len(dataloaders[phase].dataset)
-            epoch_acc = running_corrects.double() / len(dataloaders[phase].dataset)
-
-            print('{} Loss: {:.4f} Acc: {:.4f}'.format(phase, epoch_loss, epoch_acc))
+            if verbose and phase == train_name and not train_acc:
+                print('{} Loss: {:.4f}'.format(phase, epoch_loss))
+            elif verbose:
+                print('{} Loss: {:.4f} Acc: {:.4f}'.format(phase, epoch_loss, epoch_acc))
 
             # deep copy the model
             if phase == val_name and epoch_acc > best_acc:
                 best_acc = epoch_acc
-                best_model_wts = copy.deepcopy(model.state_dict())
+                _copy_state_dict_(best_model_wts, model)
             if phase == val_name:
                 val_acc_history.append(epoch_acc)
 
-        print()
+        if verbose:
+            print()
 
     time_elapsed = time.time() - since
-    print('Training complete in {:.0f}m {:.0f}s'.format(time_elapsed // 60, time_elapsed % 60))
-    print('Best val Acc: {:4f}'.format(best_acc))
+    if verbose:
+        print('Training complete in {:.0f}m {:.0f}s'.format(time_elapsed // 60, time_elapsed % 60))
+        print('Best val Acc: {:4f}'.format(best_acc))
 
     # load best model weights
     model.load_state_dict(best_model_wts)
     return model, val_acc_history
 
+"""
+Function:   create_sgd_optimizer
+
+SGD with the multi-tensor update: fused=True (one kernel for all the parameters) when every
+parameter is a floating-point CUDA tensor, else the foreach implementation.
+"""
+def create_sgd_optimizer(params, lr=0.001, momentum=0.9):
+    params = list(params)
+    # The fused kernel only checks the devices/dtypes in the first step(), not in the constructor,
+    #   so check them here instead of waiting for an error in the middle of train_model
+    if params and all(p.device.type == 'cuda' and p.is_floating_point() for p in params):
+        return optim.SGD(params, lr=lr, momentum=momentum, fused=True)
+    return optim.SGD(params, lr=lr, momentum=momentum, foreach=True)
+
+"""
+Function:   init_distributed
+
+Initializes the NCCL process group when the script is launched with
+torchrun --nproc_per_node=N (one process per GPU). Without a GPU, falls back
+to the gloo backend (CPU processes).
+
+Ref:        https://pytorch.org/tutorials/intermediate/ddp_tutorial.html
+"""
+def init_distributed():
+    # torchrun sets LOCAL_RANK, RANK and WORLD_SIZE for every process it spawns
+    if "LOCAL_RANK" not in os.environ:
+        return False, 0
+    local_rank = int(os.environ["LOCAL_RANK"])
+    if torch.cuda.is_available():
+        torch.cuda.set_device(local_rank)
+        torch.distributed.init_process_group(backend="nccl")
+    else:
+        print("CUDA is not available, using the gloo backend on the CPU...")
+        torch.distributed.init_process_group(backend="gloo")
+    return True, local_rank
+
+"""
+Function:   is_main_process
+
+True on rank 0 of the process group (or when not distributed), so that only one
+process prints the logs and plots.
+"""
+def is_main_process():
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        return torch.distributed.get_rank() == 0
+    return True
+
 """
 Function:   set_parameter_requires_grad
 """
@@ -111,12 +378,91 @@ def set_parameter_requires_grad(model, feature_extracting):
         for param in model.parameters():
             param.requires_grad = False
 
+"""
+Function:   fuse_conv_bn
+
+Folds every BatchNorm2d into the Conv2d registered right before it (Conv2d(bias=True) with
+adjusted weights) and replaces the BatchNorm2d by nn.Identity. Only valid for a frozen backbone:
+the BN layers then always use their (pretrained) running statistics, as in eval mode, also
+during training (where an unfused BN would normalize with the batch statistics).
+
+Assumes that a Conv2d and the BatchNorm2d registered right after it in the same parent module
+run consecutively in forward (conv output fed straight into the BN). This holds for the
+torchvision models of initialize_model (resnet, vgg11_bn, densenet, inception v3; alexnet and
+squeezenet have no BN), but is not checked, so do not use it on other models without verifying it.
+
+Ref:        https://pytorch.org/tutorials/intermediate/fx_conv_bn_fuser.html
+"""
+def fuse_conv_bn(model):
+    for module in list(model.modules()):
+        children = list(module.named_children())
+        for (conv_name, conv), (bn_name, bn) in zip(children, children[1:]):
+            if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d) and conv.out_channels == bn.num_features:
+                fused = torch.nn.utils.fuse_conv_bn_eval(conv.eval(), bn.eval())
+                fused.requires_grad_(False)
+                setattr(module, conv_name, fused)
+                setattr(module, bn_name, nn.Identity())
+
+"""
+Function:   quantize_backbone
+
+Dynamic INT8 quantization of the frozen nn.Linear layers (e.g. the 25088x4096 classifier
+layers of VGG/AlexNet) for feature extracting on the CPU. The trainable head stays in FP32.
+Quantized kernels only run on the CPU (fbgemm/VNNI), so do not use it for GPU training.
+
+Ref:        https://pytorch.org/tutorials/recipes/recipes/dynamic_quantization.html
+"""
+def quantize_backbone(model):
+    frozen_linears = {name: torch.ao.quantization.default_dynamic_qconfig
+                      for name, m in model.named_modules()
+                      if isinstance(m, nn.Linear) and not m.weight.requires_grad}
+    if not frozen_linears:
+        return model
+    return torch.ao.quantization.quantize_dynamic(model, qconfig_spec=frozen_linears, dtype=torch.qint8)
+
+"""
+Function:   enable_checkpointing
+
+Runs the block with activation (gradient) checkpointing while training: its activations are
+not kept for backward but recomputed, trading compute for memory. Only the forward of the block
+is replaced (a functools.partial of a module-level function, so that the model can still be
+pickled by torch.save), so the module tree and the state_dict keys stay the same. The recompute in backward does not update the BN running statistics a second time
+(see _frozen_bn_stats).
+
+Ref:        https://pytorch.org/docs/stable/checkpoint.html
+"""
+def enable_checkpointing(block):
+    block.forward = functools.partial(_checkpointed_forward, block)
+
+def _checkpointed_forward(self, x):
+    forward = type(self).forward
+    if self.training and torch.is_grad_enabled():
+        return torch.utils.checkpoint.checkpoint(lambda t: forward(self, t), x, use_reentrant=False,
+                                                 context_fn=lambda: (contextlib.nullcontext(), _frozen_bn_stats(self)))
+    return forward(self, x)
+
+@contextlib.contextmanager
+def _frozen_bn_stats(module):
+    # momentum=0 keeps running_mean/running_var as they are; num_batches_tracked is restored afterwards
+    bns = [m for m in module.modules()
+           if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.training and m.track_running_stats]
+    saved = [(m.momentum, m.num_batches_tracked.clone()) for m in bns]
+    for m in bns:
+        m.momentum = 0.0
+    try:
+        yield
+    finally:
+        for m, (momentum, num_batches_tracked) in zip(bns, saved):
+            m.momentum = momentum
+            m.num_batches_tracked.copy_(num_batches_tracked)
+
 """
 Function:   initialize_model
 
 Ref:        https://pytorch.org/tutorials/beginner/finetuning_torchvision_models_tutorial.html
 """
-def initialize_model(model_name, num_classes, feature_extract, use_pretrained=True):
+def initialize_model(model_name, num_classes, feature_extract, use_pretrained=True, memory_efficient=False,
+                     fuse_bn=False):
     # Initialize these variables which will be set in this if statement. Each of these
     #   variables is model specific.
     model_ft = None
@@ -180,13 +526,47 @@ def initialize_model(model_name, num_classes, feature_extract, use_pretrained=Tr
         num_ftrs = model_ft.fc.in_features
         model_ft.fc = nn.Linear(num_ftrs,num_classes)
         input_size = 299
+        # Checkpoint the Mixed (inception) blocks when finetuning: activation memory drops from
+        #   the whole deep graph to one block at a time, so a larger batch fits on the GPU
+        if memory_efficient and not feature_extract:
+            for name, block in model_ft.named_children():
+                if name.startswith("Mixed_"):
+                    enable_checkpointing(block)
 
     else:
         print("Invalid model name, exiting...")
         exit()
+
+    # The pretrained backbone is frozen when feature extracting, so its BN layers can be folded
+    #   into the convs (one less read/write pass over the activations per BN layer). Opt-in:
+    #   training then normalizes with the running statistics instead of the batch ones.
+    if fuse_bn and feature_extract and use_pretrained:
+        fuse_conv_bn(model_ft)
     
     return model_ft, input_size
 
+"""
+Function:   compile_model
+
+Ref:        https://pytorch.org/tutorials/intermediate/torch_compile_tutorial.html
+"""
+def compile_model(model, device):
+    # mode="reduce-overhead" captures CUDA graphs, so only compile on the GPU (this also keeps the
+    #   quantize_backbone CPU model, whose quantized kernels dynamo does not handle well, eager).
+    #   Inception returns (outputs, aux_outputs) in train mode, so keep fullgraph=False (default)
+    #   and let graph breaks fall back to eager.
+    if torch.device(device).type != 'cuda':
+        return model
+    # torch.compile is lazy and the actual compilation happens on the first forward in train_model.
+    #   suppress_errors makes dynamo log a compilation error and run that frame eagerly instead of
+    #   raising it; the try only covers the wrapper call itself (e.g. an unsupported Python version).
+    torch._dynamo.config.suppress_errors = True
+    try:
+        model = torch.compile(model, mode="reduce-overhead")
+    except Exception as e:
+        print("torch.compile could not wrap the model ({}), using the eager model...".format(e))
+    return model
+
 
 
 
@@ -333,20 +713,23 @@ def initialize_model(model_name, num_classes, feature_extract, use_pretrained=Tr
 #     """
 #     Load Data
 #     """
-#     # Data augmentation and normalization for training
-#     # Just normalization for validation
+#     # Data augmentation for training, nothing more for validation.
+#     #   Normalization is done on the GPU in train_model (see norm_mean, norm_std)
+#     #   (v2 transforms, see LoadData.py)
+#     norm_mean, norm_std = [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]
+#     from torchvision.transforms import v2
 #     data_transforms = {
-#         'train': transforms.Compose([
-#             transforms.RandomResizedCrop(input_size),
-#             transforms.RandomHorizontalFlip(),
-#             transforms.ToTensor(),
-#             transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+#         'train': v2.Compose([
+#             v2.ToImage(),
+#             v2.RandomResizedCrop(input_size),
+#             v2.RandomHorizontalFlip(),
+#             v2.ToDtype(torch.float32, scale=True),
 #         ]),
-#         'val': transforms.Compose([
-#             transforms.Resize(input_size),
-#             transforms.CenterCrop(input_size),
-#             transforms.ToTensor(),
-#             transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+#         'val': v2.Compose([
+#             v2.ToImage(),
+#             v2.Resize(input_size),
+#             v2.CenterCrop(input_size),
+#             v2.ToDtype(torch.float32, scale=True),
 #         ]),
 #     }
 
@@ -355,7 +738,9 @@ def initialize_model(model_name, num_classes, feature_extract, use_pretrained=Tr
 #     # Create training and validation datasets
 #     image_datasets = {x: datasets.ImageFolder(os.path.join(args.data_dir, x), data_transforms[x]) for x in ['train', 'val']}
 #     # Create training and validation dataloaders
-#     dataloaders_dict = {x: torch.utils.data.DataLoader(image_datasets[x], batch_size=args.batch_size, shuffle=True, num_workers=4) for x in ['train', 'val']}
+#     #   pin_memory=True is required for the non_blocking H2D copies in train_model to overlap with compute
+#     dataloaders_dict = {x: torch.utils.data.DataLoader(image_datasets[x], batch_size=args.batch_size, shuffle=True, num_workers=4,
+#                                                        pin_memory=True, persistent_workers=True) for x in ['train', 'val']}
 
 #     # data_loaders = get_data_loader()
 
@@ -369,8 +754,8 @@ def initialize_model(model_name, num_classes, feature_extract, use_pretrained=Tr
 #     """
 #     Create the Optimizer
 #     """
-#     # Send the model to GPU
-#     model_ft = model_ft.to(device)
+#     # Send the model to GPU (channels_last is the native layout of the cuDNN tensor-core conv kernels)
+#     model_ft = model_ft.to(device, memory_format=torch.channels_last)
 
 #     # Gather the parameters to be optimized/updated in this run. If we are
 #     #  finetuning we will be updating all parameters. However, if we are 
@@ -391,7 +776,7 @@ def initialize_model(model_name, num_classes, feature_extract, use_pretrained=Tr
 #                 print("\t",name)
 
 #     # Observe that all parameters are being optimized
-#     optimizer_ft = optim.SGD(params_to_update, lr=0.001, momentum=0.9)
+#     optimizer_ft = create_sgd_optimizer(params_to_update, lr=0.001, momentum=0.9)
 
 
 
@@ -402,7 +787,8 @@ def initialize_model(model_name, num_classes, feature_extract, use_pretrained=Tr
 #     criterion = nn.CrossEntropyLoss()
 
 #     # Train and evaluate
-#     model_ft, hist = train_model(model_ft, dataloaders_dict, criterion, optimizer_ft, num_epochs=args.num_epochs, is_inception=(args.model_name=="inception"))
+#     model_ft, hist = train_model(model_ft, dataloaders_dict, criterion, optimizer_ft, num_epochs=args.num_epochs, is_inception=(args.model_name=="inception"),
+#                                  mean=norm_mean, std=norm_std)
 
 
 
@@ -410,9 +796,10 @@ def initialize_model(model_name, num_classes, feature_extract, use_pretrained=Tr
 #     # Initialize the non-pretrained version of the model used for this run
 #     scratch_model,_ = initialize_model(args.model_name, args.num_classes, feature_extract=False, use_pretrained=False)
 #     scratch_model = scratch_model.to(device)
-#     scratch_optimizer = optim.SGD(scratch_model.parameters(), lr=0.001, momentum=0.9)
+#     scratch_optimizer = create_sgd_optimizer(scratch_model.parameters(), lr=0.001, momentum=0.9)
 #     scratch_criterion = nn.CrossEntropyLoss()
-#     _,scratch_hist = train_model(scratch_model, dataloaders_dict, scratch_criterion, scratch_optimizer, num_epochs=args.num_epochs, is_inception=(args.model_name=="inception"))
+#     _,scratch_hist = train_model(scratch_model, dataloaders_dict, scratch_criterion, scratch_optimizer, num_epochs=args.num_epochs, is_inception=(args.model_name=="inception"),
+#                                  mean=norm_mean, std=norm_std)
 
 #     # Plot the training curves of validation accuracy vs. number 
 #     #  of training epochs for the transfer learning method and
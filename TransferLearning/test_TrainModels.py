@@ -0,0 +1,197 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+pytest.importorskip("matplotlib")
+
+import copy
+import io
+import torch.nn as nn
+from TrainModels import *
+
+
+def get_linear_model_and_loaders(num_images, batch_size):
+    torch.manual_seed(0)
+    model = nn.Sequential(nn.Flatten(), nn.Linear(3 * 4 * 4, 2))
+    dataset = torch.utils.data.TensorDataset(torch.rand(num_images, 3, 4, 4), torch.randint(0, 2, (num_images,)))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size)
+    # Two copies of one image with different labels: always 50% accuracy, so that train_model keeps
+    #   (and reloads) the weights of the last epoch as the best ones
+    val_dataset = torch.utils.data.TensorDataset(torch.rand(1, 3, 4, 4).repeat(2, 1, 1, 1), torch.tensor([0, 1]))
+    val_loader = torch.utils.data.DataLoader(val_dataset, batch_size=2)
+    return model, {'train': loader, 'val': val_loader}
+
+
+def test_grad_accum_partial_window_is_not_scaled_down():
+    # 3 batches with grad_accum_steps=2: the last optimizer step only has one batch, whose
+    #   gradient must equal the one of the same single batch trained without accumulation
+    model, loaders = get_linear_model_and_loaders(num_images=6, batch_size=2)
+    reference = copy.deepcopy(model)
+    criterion = nn.CrossEntropyLoss()
+
+    optimizer = optim.SGD(model.parameters(), lr=0.1)
+    train_model(model, loaders, criterion, optimizer, torch.device("cpu"), 'train', 'val', num_epochs=1,
+                grad_accum_steps=2)
+
+    # Same updates by hand: mean gradient of batches 0 and 1, then the gradient of batch 2
+    ref_optimizer = optim.SGD(reference.parameters(), lr=0.1)
+    batches = list(loaders['train'])
+    for window in [batches[:2], batches[2:]]:
+        ref_optimizer.zero_grad()
+        for inputs, labels in window:
+            (criterion(reference(inputs), labels) / len(window)).backward()
+        ref_optimizer.step()
+
+    for p, ref_p in zip(model.parameters(), reference.parameters()):
+        assert torch.allclose(p, ref_p, atol=1e-6)
+
+
+def test_grad_accum_steps_must_be_positive():
+    model, loaders = get_linear_model_and_loaders(num_images=2, batch_size=2)
+    optimizer = optim.SGD(model.parameters(), lr=0.1)
+    with pytest.raises(ValueError):
+        train_model(model, loaders, nn.CrossEntropyLoss(), optimizer, torch.device("cpu"), 'train', 'val',
+                    num_epochs=1, grad_accum_steps=0)
+
+
+def get_random_loaders(num_images=4, batch_size=2, input_size=224, num_classes=2):
+    dataset = torch.utils.data.TensorDataset(torch.rand(num_images, 3, input_size, input_size),
+                                             torch.randint(0, num_classes, (num_images,)))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size)
+    return {'train': loader, 'val': loader}
+
+
+def test_train_model_quantized_backbone():
+    # Feature extracting on the CPU with the frozen Linear layers in INT8 (see quantize_backbone)
+    model, input_size = initialize_model("alexnet", 2, feature_extract=True, use_pretrained=False)
+    model = quantize_backbone(model)
+    params_to_update = [p for p in model.parameters() if p.requires_grad]
+    optimizer = optim.SGD(params_to_update, lr=0.001, momentum=0.9)
+
+    model, hist = train_model(model, get_random_loaders(input_size=input_size), nn.CrossEntropyLoss(), optimizer,
+                              torch.device("cpu"), 'train', 'val', num_epochs=2)
+
+    assert len(hist) == 2
+    assert isinstance(model.classifier[0], torch.ao.nn.quantized.dynamic.Linear)
+    assert isinstance(model.classifier[6], nn.Linear)
+
+
+def get_conv_bn_block():
+    torch.manual_seed(0)
+    return nn.Sequential(nn.Conv2d(3, 4, 3), nn.BatchNorm2d(4), nn.ReLU())
+
+
+def test_checkpointing_keeps_bn_running_stats():
+    block = get_conv_bn_block()
+    checkpointed = copy.deepcopy(block)
+    enable_checkpointing(checkpointed)
+    inputs = torch.rand(2, 3, 8, 8, requires_grad=True)
+
+    for model in [block, checkpointed]:
+        model.train()
+        model(inputs).sum().backward()
+
+    assert checkpointed[1].num_batches_tracked.item() == block[1].num_batches_tracked.item() == 1
+    assert checkpointed[1].momentum == block[1].momentum
+    assert torch.allclose(checkpointed[1].running_mean, block[1].running_mean)
+    assert torch.allclose(checkpointed[1].running_var, block[1].running_var)
+    assert torch.allclose(checkpointed[0].weight.grad, block[0].weight.grad)
+
+
+def test_checkpointing_keeps_module_tree():
+    block = get_conv_bn_block()
+    checkpointed = copy.deepcopy(block)
+    enable_checkpointing(checkpointed)
+    assert list(checkpointed.state_dict().keys()) == list(block.state_dict().keys())
+    # The replaced forward follows the module when it is copied or saved
+    copied = copy.deepcopy(checkpointed)
+    assert copied.forward.args[0] is copied
+    buffer = io.BytesIO()
+    torch.save(checkpointed, buffer)
+    buffer.seek(0)
+    loaded = torch.load(buffer, weights_only=False)
+    assert loaded.forward.args[0] is loaded
+    inputs = torch.rand(2, 3, 8, 8)
+    checkpointed.eval()
+    loaded.eval()
+    with torch.no_grad():
+        assert torch.equal(loaded(inputs), checkpointed(inputs))
+
+    model, _ = initialize_model("inception", 2, feature_extract=False, use_pretrained=False, memory_efficient=True)
+    reference, _ = initialize_model("inception", 2, feature_extract=False, use_pretrained=False)
+    model.load_state_dict(reference.state_dict())
+
+
+def test_best_weights_buffer_is_updated_in_place():
+    model = nn.Sequential(nn.Conv2d(3, 4, 3), nn.BatchNorm2d(4))
+    buffer = _clone_state_dict(model)
+    storages = {k: v.data_ptr() for k, v in buffer.items()}
+    assert buffer._metadata == model.state_dict()._metadata
+
+    with torch.no_grad():
+        model[0].weight.add_(1.0)
+    model[1].running_mean.fill_(3.0)
+    _copy_state_dict_(buffer, model)
+
+    assert {k: v.data_ptr() for k, v in buffer.items()} == storages
+    for k, v in model.state_dict().items():
+        assert torch.equal(buffer[k], v)
+    model.load_state_dict(buffer)
+
+
+@pytest.mark.parametrize("device", ["cpu", pytest.param("cuda", marks=pytest.mark.skipif(
+    not torch.cuda.is_available(), reason="needs a GPU"))])
+def test_prefetcher_normalization_matches_normalize(device):
+    mean, std = (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)
+    images = torch.rand(4, 3, 8, 8)
+    dataset = torch.utils.data.TensorDataset(images, torch.zeros(4, dtype=torch.long))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=2)
+    prefetcher = DataPrefetcher(loader, device, mean=mean, std=std)
+
+    # Iterated twice like in train_model, where it is reused every epoch
+    for _ in range(2):
+        outputs = torch.cat([inputs.cpu() for inputs, _ in prefetcher])
+        assert torch.allclose(outputs, transforms.Normalize(mean, std)(images), atol=1e-6)
+
+
+def test_eval_model_is_traced():
+    torch.manual_seed(0)
+    model, input_size = initialize_model("resnet", 2, feature_extract=False, use_pretrained=False)
+    model.eval()
+    dataset = torch.utils.data.TensorDataset(torch.rand(4, 3, input_size, input_size), torch.tensor([0, 1, 0, 1]))
+    batches = DataPrefetcher(torch.utils.data.DataLoader(dataset, batch_size=2), "cpu")
+    running_loss, running_corrects = torch.zeros(()), torch.zeros((), dtype=torch.long)
+
+    # Traced inside the inference_mode validation pass, like in train_model
+    eval_model = _run_eval_epoch(model, None, batches, nn.CrossEntropyLoss(), False, torch.float16,
+                                 running_loss, running_corrects)
+
+    assert isinstance(eval_model, torch.jit.ScriptModule)
+    with torch.no_grad():
+        for inputs, _ in batches:
+            assert torch.allclose(eval_model(inputs), model(inputs), atol=1e-5)
+
+
+@pytest.mark.parametrize("model_name", ["resnet", "vgg", "densenet", "inception"])
+def test_fuse_conv_bn_keeps_eval_outputs(model_name):
+    torch.manual_seed(0)
+    model, input_size = initialize_model(model_name, 2, feature_extract=True, use_pretrained=False)
+    inputs = torch.rand(2, 3, input_size, input_size)
+    # Non-trivial running statistics (they are 0 and 1 right after the initialization)
+    model.train()
+    with torch.no_grad():
+        for m in model.modules():
+            if isinstance(m, nn.BatchNorm2d):
+                m.momentum = None
+        model(torch.rand(2, 3, input_size, input_size))
+
+    fused = copy.deepcopy(model)
+    fuse_conv_bn(fused)
+    # Only the BN layers right after a conv are folded (e.g. not the pre-activation ones of densenet)
+    num_bns = lambda m: sum(isinstance(x, nn.BatchNorm2d) for x in m.modules())
+    assert num_bns(fused) < num_bns(model)
+
+    model.eval()
+    fused.eval()
+    with torch.no_grad():
+        assert torch.allclose(fused(inputs), model(inputs), atol=1e-4)